@@ -3,13 +3,34 @@ import subprocess
 import threading
 from tkinter import messagebox
 import pyttsx3
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-import pytz
+from zoneinfo import ZoneInfo
+
+_NY_TZ = ZoneInfo('America/New_York')
+_NY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# AppleScript run by say_nonblocking: argv is (volume, text[, voice])
+_SAY_SCRIPT = [
+    'on run argv',
+    'set volume output volume (item 1 of argv as integer)',
+    'if (count of argv) > 2 then',
+    'say (item 2 of argv) using (item 3 of argv)',
+    'else',
+    'say (item 2 of argv)',
+    'end if',
+    'end run',
+]
+
+_tts_engine = None
+_tts_lock = threading.Lock()
 
 def say_nonblocking(text, voice=None, volume=2):
     """
-    Say text on macOS using the 'say' command in a non-blocking way 
+    Say text on macOS in a non-blocking way. A single 'osascript' process runs
+    _SAY_SCRIPT, which sets the output volume and then speaks with AppleScript's
+    'say'. Volume, text and voice are passed as script arguments (argv).
     
     Parameters:
     -----------
@@ -18,21 +39,20 @@ def say_nonblocking(text, voice=None, volume=2):
     voice : str, optional
         Voice to use (e.g., 'Alex', 'Samantha', 'Victoria')
     volume : int, optional
-        Volume level (0-100, default is 50)
+        Output volume level (0-100, default is 2)
     """
     print("Speaking:", text)
     def speak():
         try:
-            # Set system volume before speaking
-            # This requires 'osascript' which is available on macOS
-            volume_cmd = ['osascript', '-e', f'set volume output volume {volume}']
-            subprocess.run(volume_cmd, check=True)
-            
-            # Now speak the text
-            cmd = ['say']
+            # Set system volume and speak the text in a single 'osascript' process
+            # (available on macOS). Arguments are passed through argv so the
+            # text never needs AppleScript quoting.
+            cmd = ['osascript']
+            for line in _SAY_SCRIPT:
+                cmd.extend(['-e', line])
+            cmd.extend([str(volume), text])
             if voice:
-                cmd.extend(['-v', voice])
-            cmd.append(text)
+                cmd.append(voice)
             subprocess.run(cmd, check=True)
             
             # Optional: Reset volume to a default level when done
@@ -45,19 +65,22 @@ def say_nonblocking(text, voice=None, volume=2):
     thread.start()
 
 def say_hello():
+    global _tts_engine
     print("Hello")
     messagebox.showinfo("Greeting", "Hello")
-    engine = pyttsx3.init()
-    engine.say("Hello")
-    engine.runAndWait()
+    with _tts_lock:
+        # Initializing the speech driver is slow, so do it once and reuse it
+        if _tts_engine is None:
+            _tts_engine = pyttsx3.init()
+        _tts_engine.say("Hello")
+        _tts_engine.runAndWait()
 
 def convert_utc_to_ny(utc_time_str):
     """Convert UTC timestamp string to New York timezone formatted string"""
     try:
-        return (datetime.fromisoformat(utc_time_str.replace('Z', '+00:00'))
-                .astimezone(pytz.timezone('America/New_York'))
-                .replace(tzinfo=None, microsecond=0)
-                .strftime('%Y-%m-%d %H:%M:%S'))
+        if utc_time_str.endswith('Z'):
+            utc_time_str = utc_time_str[:-1] + '+00:00'
+        return datetime.fromisoformat(utc_time_str).astimezone(_NY_TZ).strftime(_NY_TIME_FORMAT)
     except Exception as e:
         print(f"Error converting time: {e}")
         return None
@@ -68,46 +91,58 @@ def updown(direction):
 class TimeBasedMovement:
 
     def __init__(self, range):
-        self.data = []  # Fixed: added 'self.' prefix
         self.range = range
+        self._range_td = pd.Timedelta(minutes=range).to_timedelta64()
         self.max_size = 500
+        # Timestamps and prices live in parallel arrays with room for two windows,
+        # so the last max_size samples are always one contiguous, sorted slice
+        self.timestamps = np.empty(2 * self.max_size, dtype='datetime64[ns]')
+        self.prices = np.empty(2 * self.max_size, dtype=np.float64)
+        self.start = 0
+        self.end = 0
 
     def add(self, timestamp, price):
-        self.data.append(
-            {
-                "timestamp": timestamp,
-                "price": price,
-            }
-        )
-        
-        # Remove oldest data if queue exceeds max size
-        if len(self.data) > self.max_size:
-            self.data.pop(0)
+        # Once the buffer is full, shift the newest samples back to the front;
+        # this happens once every max_size inserts so add stays O(1) amortized
+        if self.end == len(self.prices):
+            keep = self.max_size - 1
+            self.timestamps[:keep] = self.timestamps[self.end - keep:self.end]
+            self.prices[:keep] = self.prices[self.end - keep:self.end]
+            self.start = 0
+            self.end = keep
+
+        self.timestamps[self.end] = pd.Timestamp(timestamp).to_datetime64()
+        self.prices[self.end] = price
+        self.end += 1
+
+        # Drop oldest data if queue exceeds max size
+        if self.end - self.start > self.max_size:
+            self.start += 1
 
     def clear(self):
         """Clear the stored data."""
-        self.data = []
+        self.start = 0
+        self.end = 0
 
     def calc(self):
         # Calculate the movement of the price for the last 5 minutes
-        if len(self.data) < 2:
+        if self.end - self.start < 2:
             return 0.0
 
-        # Get the price data for the last n minutes
-        range_ago = self.data[-1]["timestamp"] - pd.Timedelta(minutes=self.range)
-        relevant_data = [d for d in self.data if d["timestamp"] > range_ago]
+        # Find the first sample within the last n minutes
+        timestamps = self.timestamps[self.start:self.end]
+        range_ago = timestamps[-1] - self._range_td
+        first = np.searchsorted(timestamps, range_ago, side='right')
 
-        if not relevant_data:
+        if first == len(timestamps):
             return 0.0
 
         # Calculate the price movement percentage
-        start_price = relevant_data[0]["price"]
-        end_price = relevant_data[-1]["price"]
+        start_price = self.prices[self.start + first]
+        end_price = self.prices[self.end - 1]
         
         # Avoid division by zero
         if start_price == 0:
             return 0.0
             
-        return ((end_price - start_price) / start_price) * 100
-
-
+        return float((end_price - start_price) / start_price * 100)
@@ -1,8 +1,12 @@
 import json
+import orjson
 import time
 import redis
+from redis.utils import HIREDIS_AVAILABLE
 import threading
-import uuid
+import queue
+import socket
+import signal
 import sys
 import os
 import argparse
@@ -15,13 +19,24 @@ class TransactionStreamer:
         self.broker_name = broker_name
         self.credentials = None
         self.redis_client = None
-        self.transaction_key_prefix = "transaction_data:"
-        self.transaction_index_key = "transaction_index"
+        self.pool = None
+        self.publisher_thread = None
+        # Transactions waiting to be written to Redis by the publisher thread;
+        # bounded so a stalled publisher applies back-pressure instead of growing forever
+        self.publish_queue = queue.Queue(maxsize=1000)
+        # Set to stop the service
+        self._stop = threading.Event()
+        self.stream_key = "transaction_stream"
+        # Redis < 6.2 has no XADD/XTRIM MINID, so the stream is capped by length instead
+        self.stream_trim_by_minid = True
+        self.stream_maxlen = 1000
+        # Server clock minus local clock, so MINID matches the server's stream IDs
+        self._clock_offset = 0.0
+        self._server_checked = False
         # Add TTL configuration
         # CLI-provided TTL takes precedence over config file
         self._cli_transaction_ttl = transaction_ttl
         self.transaction_ttl = 300  # Default 5 minutes for transactions
-        self.index_ttl = 600  # Default 10 minutes
         self.load_credentials()
         self.load_config()
 
@@ -65,9 +80,8 @@ class TransactionStreamer:
                 # Load TTL configuration
                 ttl_config = config.get('ttl', {})
                 self.transaction_ttl = ttl_config.get('transaction_data', 300)  # Default 5 minutes
-                self.index_ttl = ttl_config.get('transaction_index', 600)  # Default 10 minutes
             print(f"✅ Loaded transaction streamer config")
-            print(f"⏱️ TTL - Transaction data: {self.transaction_ttl}s, Index: {self.index_ttl}s")
+            print(f"⏱️ TTL - Transaction data: {self.transaction_ttl}s")
         except FileNotFoundError:
             print("⚠️ No config/stream_transaction.json found, using defaults")
             self.redis_config = {'host': 'localhost', 'port': 6379, 'db': 0}
@@ -83,14 +97,32 @@ class TransactionStreamer:
         
         for attempt in range(max_redis_retries):
             try:
-                self.redis_client = redis.Redis(
-                    host=self.redis_config['host'], 
-                    port=self.redis_config['port'], 
-                    db=self.redis_config['db'], 
-                    socket_connect_timeout=5
-                )
+                # Build the pool once and reuse it across reconnects; broken
+                # connections are dropped and re-established by the pool itself.
+                # redis-py already sets TCP_NODELAY on every connection it opens,
+                # so small command writes are never held back by Nagle's algorithm.
+                if self.pool is None:
+                    keepalive_options = {}
+                    if hasattr(socket, 'TCP_KEEPIDLE'):  # Not available on macOS
+                        keepalive_options[socket.TCP_KEEPIDLE] = 30
+                    self.pool = redis.BlockingConnectionPool(
+                        host=self.redis_config['host'],
+                        port=self.redis_config['port'],
+                        db=self.redis_config['db'],
+                        max_connections=16,
+                        socket_connect_timeout=5,
+                        socket_keepalive=True,
+                        socket_keepalive_options=keepalive_options,
+                        health_check_interval=30
+                    )
+                self.redis_client = redis.Redis(connection_pool=self.pool)
                 # Test connection
                 self.redis_client.ping()
+
+                # Check server capabilities once, not on every reconnect
+                if not self._server_checked:
+                    self._check_redis_server()
+                    self._server_checked = True
                 
                 # Disable Redis persistence to prevent dump.rdb file creation
                 try:
@@ -111,6 +143,34 @@ class TransactionStreamer:
                     print("💡 Please ensure Redis is running: redis-server")
                     raise
 
+    def _check_redis_server(self):
+        """Check the Redis server version, clock and client parser."""
+        # Streams need Redis 5.0; trimming by age (MINID) needs 6.2
+        try:
+            redis_version = self.redis_client.info('server').get('redis_version', '0')
+            version = tuple(int(part) for part in str(redis_version).split('.')[:2])
+        except (redis.ResponseError, ValueError) as e:
+            self.stream_trim_by_minid = False
+            print(f"⚠️ Could not determine Redis version ({e}), capping stream at {self.stream_maxlen} messages")
+        else:
+            if version < (5, 0):
+                print(f"❌ Redis {redis_version} does not support streams, Redis 5.0 or newer is required")
+                raise RuntimeError(f"Unsupported Redis version {redis_version}")
+            self.stream_trim_by_minid = version >= (6, 2)
+            if not self.stream_trim_by_minid:
+                print(f"⚠️ Redis {redis_version} cannot trim streams by age, capping stream at {self.stream_maxlen} messages")
+
+        # Stream IDs come from the server clock; measure how far ours is off
+        try:
+            seconds, microseconds = self.redis_client.time()
+            self._clock_offset = seconds + microseconds / 1e6 - time.time()
+        except redis.ResponseError as e:
+            print(f"⚠️ Could not read Redis server time, assuming clocks match: {e}")
+
+        # redis-py picks the hiredis C reply parser automatically when it is installed
+        if not HIREDIS_AVAILABLE:
+            print("⚠️ hiredis not installed, using pure-Python Redis parser (pip install 'redis[hiredis]')")
+
     def run_transaction_stream(self):
         """Stream transactions from OANDA account."""
         max_retries = 10
@@ -125,21 +185,11 @@ class TransactionStreamer:
                 try:
                     account_state = broker.get_account_state(self.credentials)
                     if account_state and not account_state.get('error'):
-                        state_key = f"{self.transaction_key_prefix}account_state:{self.credentials.get('account_id')}:{uuid.uuid4().hex[:8]}"
-                        # Store with TTL so it self-cleans
-                        self.redis_client.setex(state_key, self.transaction_ttl, json.dumps({'type': 'account_state', 'state': account_state}))
-                        self.redis_client.sadd(self.transaction_index_key, state_key)
-                        self.redis_client.expire(self.transaction_index_key, self.index_ttl)
-
-                        # Also publish to Redis stream for consumers that read the stream
-                        try:
-                            # Use field 'state' to hold the JSON payload
-                            self.redis_client.xadd('transaction_stream', {'state': json.dumps(account_state)})
-                        except Exception:
-                            # If Redis doesn't support streams or fails, ignore stream publish
-                            pass
+                        # Use field 'state' to hold the JSON payload. It goes through the
+                        # publisher like transactions so it lands on the stream in order.
+                        self._enqueue(('account state', 'state', orjson.dumps(account_state)))
 
-                        print("📥 Published initial account state to Redis")
+                        print("📥 Queued initial account state for Redis")
                     else:
                         print(f"⚠️ Could not fetch account state: {account_state.get('error') if account_state else 'unknown'}")
                 except Exception as e:
@@ -156,7 +206,7 @@ class TransactionStreamer:
                     # Print transaction as it comes in
                     print(f"💼 Transaction {transaction_id}: {transaction_type} at {transaction.get('time')}")
                         
-                    # Publish transaction data to Redis with TTL
+                    # Publish transaction data to the Redis stream
                     transaction_data = {
                         'id': transaction_id,
                         'type': transaction_type,
@@ -168,37 +218,8 @@ class TransactionStreamer:
                         'data': transaction  # Store full transaction data
                     }
                     
-                    try:
-                        # Generate unique key for this transaction message
-                        transaction_key = f"{self.transaction_key_prefix}{transaction_type}:{transaction_id}:{uuid.uuid4().hex[:8]}"
-                        
-                        # Set the transaction data with configurable TTL
-                        self.redis_client.setex(transaction_key, self.transaction_ttl, json.dumps(transaction_data))
-                        
-                        # Add to transaction index (also with TTL to self-cleanup)
-                        self.redis_client.sadd(self.transaction_index_key, transaction_key)
-                        self.redis_client.expire(self.transaction_index_key, self.index_ttl)
-                        
-                        # Get current queue length (count of active transaction keys)
-                        queue_length = self.redis_client.scard(self.transaction_index_key)
-                        
-                        # Clean up expired keys from index
-                        self._cleanup_expired_keys()
-                        
-                        print(f"📤 Put transaction {transaction_id} (TTL: {self.transaction_ttl}s, active messages: {queue_length})")
-                        
-                    except redis.ConnectionError:
-                        print(f"❌ Lost Redis connection, attempting to reconnect...")
-                        self.connect_to_redis()
-                        
-                        # Retry the operation
-                        transaction_key = f"{self.transaction_key_prefix}{transaction_type}:{transaction_id}:{uuid.uuid4().hex[:8]}"
-                        self.redis_client.setex(transaction_key, self.transaction_ttl, json.dumps(transaction_data))
-                        self.redis_client.sadd(self.transaction_index_key, transaction_key)
-                        self.redis_client.expire(self.transaction_index_key, self.index_ttl)
-                        queue_length = self.redis_client.scard(self.transaction_index_key)
-                        self._cleanup_expired_keys()
-                        print(f"📤 Put transaction {transaction_id} after reconnect (active messages: {queue_length})")
+                    # Hand off to the publisher thread so the stream never waits on Redis
+                    self._enqueue((f"transaction {transaction_id}", 'data', orjson.dumps(transaction_data)))
 
                     retry_count = 0
                     retry_delay = 5
@@ -218,68 +239,155 @@ class TransactionStreamer:
             time.sleep(retry_delay)
             retry_delay = min(retry_delay * 1.5, 60)
 
-    def _cleanup_expired_keys(self):
-        """Remove expired keys from the transaction index."""
+    def _enqueue(self, message):
+        """Queue a (label, field, payload) message for the publisher thread."""
         try:
-            # Get all keys in the index
-            transaction_keys = self.redis_client.smembers(self.transaction_index_key)
-            expired_keys = []
-            
-            for key_bytes in transaction_keys:
-                key = key_bytes.decode('utf-8') if isinstance(key_bytes, bytes) else key_bytes
-                # Check if the key still exists (hasn't expired)
-                if not self.redis_client.exists(key):
-                    expired_keys.append(key)
-            
-            # Remove expired keys from index
-            if expired_keys:
-                self.redis_client.srem(self.transaction_index_key, *expired_keys)
-                
-        except redis.ConnectionError:
-            pass  # Skip cleanup if connection issues
+            self.publish_queue.put_nowait(message)
+        except queue.Full:
+            print(f"⚠️ Publish queue full ({self.publish_queue.maxsize} pending), waiting for Redis publisher...")
+            self.publish_queue.put(message)
+
+    def run_publisher(self):
+        """Publish queued messages to Redis, batching whatever has piled up."""
+        while True:
+            batch = [self.publish_queue.get()]
+            # Drain everything queued behind it so a burst goes out in one round-trip
+            while True:
+                try:
+                    batch.append(self.publish_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # A None entry asks the publisher to stop once the messages ahead of it are written
+            stopping = None in batch
+            batch = [message for message in batch if message is not None]
+            if not batch:
+                return
+
+            try:
+                queue_length = self._publish_transactions(batch)
+                for label, _, _ in batch:
+                    print(f"📤 Put {label} (TTL: {self.transaction_ttl}s, active messages: {queue_length})")
+
+            except (redis.ConnectionError, redis.TimeoutError):
+                print(f"❌ Lost Redis connection, attempting to reconnect...")
+                try:
+                    self.connect_to_redis()
+                    
+                    # Retry the operation
+                    queue_length = self._publish_transactions(batch)
+                    for label, _, _ in batch:
+                        print(f"📤 Put {label} after reconnect (active messages: {queue_length})")
+                except Exception as e:
+                    print(f"❌ Dropped {len(batch)} message(s) after reconnect failed: {e}")
+
+            except Exception as e:
+                # Any other error (e.g. a ResponseError) must not kill the publisher thread
+                print(f"❌ Dropped {len(batch)} message(s), error publishing to Redis: {e}")
+
+            if stopping:
+                return
+
+    def _publish_transactions(self, batch):
+        """Append (label, field, payload) messages to the Redis stream in a single pipeline.
+
+        Each XADD trims entries older than the transaction TTL (stream IDs are
+        millisecond timestamps), or beyond stream_maxlen on Redis < 6.2, so the
+        stream caps its own memory server-side.
+        Returns the number of messages on the stream.
+        """
+        trim_args = self._stream_trim_args()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for _, field, payload in batch:
+            pipe.xadd(self.stream_key, {field: payload}, **trim_args)
+        # Get current queue length (count of messages on the stream)
+        pipe.xlen(self.stream_key)
+        return pipe.execute()[-1]
+
+    def _stream_trim_args(self):
+        """Return the XADD/XTRIM trimming arguments for this Redis server.
+
+        By default an exact trim to the oldest stream ID still within the
+        transaction TTL. Stream IDs use the server clock, so the local time is
+        corrected by the offset measured against Redis TIME on connect.
+        On servers without MINID support, an approximate maximum length.
+        """
+        if self.stream_trim_by_minid:
+            now = time.time() + self._clock_offset
+            return {'minid': int((now - self.transaction_ttl) * 1000), 'approximate': False}
+        return {'maxlen': self.stream_maxlen, 'approximate': True}
 
     def run(self):
         """Start the transaction streaming service."""
         print(f"🚀 Starting OANDA transaction streaming service...")
         
-        # Clear old transaction data on startup
+        # Drop transaction messages that outlived their TTL while we were down
         try:
-            # Clean up any existing transaction keys and index
-            old_keys = self.redis_client.keys(f"{self.transaction_key_prefix}*")
-            if old_keys:
-                self.redis_client.delete(*old_keys)
-                print(f"🗑️ Cleared {len(old_keys)} old transaction keys")
-            
-            # Clear the transaction index
-            self.redis_client.delete(self.transaction_index_key)
-            print("✨ Transaction data cleared and ready")
-            
-        except redis.ConnectionError as e:
-            print(f"❌ Could not clear old transaction data: {e}")
+            self.redis_client.xtrim(self.stream_key, **dict(self._stream_trim_args(), approximate=False))
+            print("✨ Transaction stream trimmed and ready")
+        except (redis.ConnectionError, redis.ResponseError) as e:
+            print(f"❌ Could not trim old transaction data: {e}")
         
         # Start transaction streaming
+        self.publisher_thread = threading.Thread(target=self.run_publisher, daemon=True)
+        self.publisher_thread.start()
         transaction_thread = threading.Thread(target=self.run_transaction_stream, daemon=True)
         transaction_thread.start()
         
         print("✅ Transaction streaming service started")
-        print(f"⏰ Transaction messages auto-expire after {self.transaction_ttl} seconds")
+        if self.stream_trim_by_minid:
+            print(f"⏰ Transaction messages are trimmed from the stream after {self.transaction_ttl} seconds")
+        else:
+            print(f"⏰ Transaction stream is capped at about {self.stream_maxlen} messages")
         
-        # Keep the main thread alive
+        # Keep the main thread alive; CTRL-C wakes it immediately instead of
+        # waiting out the current 30 second interval
+        signal.signal(signal.SIGINT, lambda *args: self._stop.set())
         try:
-            while True:
-                time.sleep(30)
-                active_count = self.redis_client.scard(self.transaction_index_key) if self.redis_client else 0
+            while not self._stop.wait(30):
+                active_count = 0
+                if self.redis_client:
+                    try:
+                        # Also trim here so expired messages go away while no new ones arrive
+                        pipe = self.redis_client.pipeline(transaction=False)
+                        pipe.xtrim(self.stream_key, **self._stream_trim_args())
+                        pipe.xlen(self.stream_key)
+                        active_count = pipe.execute()[-1]
+                    except redis.RedisError as e:
+                        print(f"⚠️ Could not read transaction stream status: {e}")
+                        continue
                 print(f"📊 Active transaction messages: {active_count}")
-                        
-        except KeyboardInterrupt:
+            
             print("\n🛑 Transaction streamer stopped by user")
+        finally:
+            # A second CTRL-C interrupts the shutdown flush below
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            self._stop_publisher()
+
+    def _stop_publisher(self, timeout=5):
+        """Let the publisher flush queued transactions, then report any left behind."""
+        try:
+            self.publish_queue.put(None, timeout=timeout)
+            self.publisher_thread.join(timeout)
+        except queue.Full:
+            pass
+
+        dropped = 0
+        while True:
+            try:
+                if self.publish_queue.get_nowait() is not None:
+                    dropped += 1
+            except queue.Empty:
+                break
+        if dropped:
+            print(f"⚠️ Dropped {dropped} unpublished message(s) on shutdown")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the transaction streamer")
     parser.add_argument('-b', '--broker', choices=['oanda', 'ib', 'alpaca'], default='oanda',
                         help='Broker name to stream transactions from')
     parser.add_argument('-t', '--ttl', type=int, default=None,
-                        help='TTL (in seconds) for each transaction message stored in Redis')
+                        help='TTL (in seconds) for each transaction message kept on the Redis stream')
     args = parser.parse_args()
 
     streamer = TransactionStreamer(args.broker, transaction_ttl=args.ttl)